@@ -5,62 +5,335 @@ Each client needs password to access their dashboard
 NEW FEATURES:
 - Password hash stored in database
 - Login page before dashboard access
-- Session-based authentication
+- Signed per-client auth cookie (itsdangerous)
 - Secure password hashing with bcrypt
 """
 
 import os
-import json
+import re
+import base64
+import binascii
+import atexit
+import hmac
 import hashlib
-from datetime import datetime, timedelta, timezone
-
-from flask import Flask, request, jsonify, abort, render_template, session, redirect, url_for
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+import click
+from flask import Flask, request, jsonify, abort, render_template, redirect, url_for, g, send_file
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+import bcrypt
+import orjson
 import psycopg2
 import psycopg2.extras
-from psycopg2.pool import SimpleConnectionPool
+import redis
+from psycopg2.pool import ThreadedConnectionPool
+
+
+class OrjsonProvider(JSONProvider):
+    """jsonify() / app.json backed by orjson instead of the stdlib encoder"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=DefaultJSONProvider.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=DefaultJSONProvider.default)
+        return self._app.response_class(body, mimetype="application/json")
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.getenv("SECRET_KEY", "change-this-in-production-please")
+# Oversized push-data bodies are rejected with 413 before they are read
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_BODY_MB", "25")) * 1024 * 1024
 
 # ---- Required env vars ----
 API_KEY = os.getenv("API_KEY", "").strip()
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
+REDIS_URL = os.getenv("REDIS_URL", "").strip()  # optional, shares verify cache across workers
 
 # ---- Trial settings ----
 TRIAL_DAYS = int(os.getenv("TRIAL_DAYS", "3"))
 MAX_VIEWS = int(os.getenv("MAX_VIEWS", "3"))
 HTML_VALID_HOURS = int(os.getenv("HTML_VALID_HOURS", "24"))
 
+# ---- Auth cookies ----
+AUTH_MAX_AGE = int(os.getenv("AUTH_MAX_AGE", "3600"))
+AUTH_COOKIE_SECURE = os.getenv("AUTH_COOKIE_SECURE", "1") == "1"
+_auth_serializer = URLSafeTimedSerializer(app.secret_key, salt="report-auth")
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+CLIENT_ID_RE = re.compile(r"\A[A-Za-z0-9_-]{1,64}\Z")
+
+# ---- Push durability ----
+# Opt-in: let push-data return before its WAL is flushed; Postgres groups the
+# flushes (wal_writer_delay) instead of one fsync per push. A crash can lose
+# the last few hundred ms of pushes, which the uploader simply re-sends.
+PUSH_ASYNC_COMMIT = os.getenv("PUSH_ASYNC_COMMIT", "0") == "1"
+
+# ---- Password hashing ----
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "12"))
+BCRYPT_MAX_BYTES = 72  # bcrypt only reads 72 bytes; bcrypt>=5 raises ValueError past that
+VERIFY_CACHE_SIZE = 1024
+VERIFY_CACHE_TTL = int(os.getenv("VERIFY_CACHE_TTL", "3600"))
+
+# (hashed, password_mac(password, hashed)) -> bool, most recently used last
+_verify_cache: OrderedDict[tuple[str, str], bool] = OrderedDict()
+_verify_lock = threading.Lock()
+_redis: redis.Redis | None = None
+
+# ---- Report payload cache ----
+# Entries hold the serialized data (often several MB), so the byte cap is what
+# bounds worker memory; the count only limits bookkeeping for tiny payloads
+PAYLOAD_CACHE_SIZE = int(os.getenv("PAYLOAD_CACHE_SIZE", "256"))
+PAYLOAD_CACHE_BYTES = int(os.getenv("PAYLOAD_CACHE_MB", "64")) * 1024 * 1024
+
+
+class CachedPayload(NamedTuple):
+    """One client's report body parts; only valid for its updated_at"""
+    updated_at: datetime
+    year: object
+    data_json: bytes  # pre-serialized "data"/"monthly_data" members
+    excel_filename: str | None
+    has_excel: bool
+
+
+# client_id -> CachedPayload, most recently used last; push-data drops entries explicitly
+_payload_cache: OrderedDict[str, CachedPayload] = OrderedDict()
+_payload_lock = threading.Lock()
+_payload_cache_bytes = 0  # sum of len(data_json) over the entries
+
 # ---- Connection pool ----
-POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
-POOL_MAX = int(os.getenv("PG_POOL_MAX", "5"))
+# Sized to the gunicorn threads per worker so request threads never wait on a connection.
+# The pool closes returned connections beyond POOL_MIN idle ones, so POOL_MIN keeps one
+# (already PREPAREd) connection per thread instead of reconnecting under load.
+WORKER_THREADS = int(os.getenv("GUNICORN_THREADS", "4"))
+POOL_MAX = int(os.getenv("PG_POOL_MAX", str(2 * WORKER_THREADS)))
+POOL_MIN = int(os.getenv("PG_POOL_MIN", str(min(WORKER_THREADS, POOL_MAX))))
+
+_pool: ThreadedConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+# JSONB columns (payload_json on a cache miss) decode with orjson, not the stdlib json module
+psycopg2.extras.register_default_jsonb(loads=orjson.loads, globally=True)
+
+# ---- Prepared statements (once per physical connection) ----
+PREPARED_STATEMENTS = {
+    "client_password": """
+        SELECT password_hash FROM clients WHERE client_id = $1
+    """,
+    "payload_fetch": """
+        SELECT payload_json, updated_at, excel_filename,
+               (excel_data IS NOT NULL OR excel_b64 IS NOT NULL) AS has_excel
+        FROM payloads
+        WHERE client_id = $1
+    """,
+    "report_lookup": f"""
+        SELECT c.trial_start, c.views_used, c.window_expires_at, p.updated_at,
+               now() <= c.trial_start + make_interval(days => {TRIAL_DAYS}) AS trial_active,
+               (c.window_expires_at > now()) IS TRUE AS window_open
+        FROM clients c
+        LEFT JOIN payloads p USING (client_id)
+        WHERE c.client_id = $1
+    """,
+    # Page view: client + payload presence, and refresh the access window only
+    # when it has lapsed. The UPDATE re-checks its WHERE on the locked row, so
+    # concurrent views cannot consume two quota units for one window; when no
+    # refresh is needed nothing is written.
+    "page_access": f"""
+        WITH cur AS (
+            SELECT c.client_id, c.trial_start, c.views_used, c.window_expires_at,
+                   p.client_id IS NOT NULL AS has_payload
+            FROM clients c
+            LEFT JOIN payloads p USING (client_id)
+            WHERE c.client_id = $1
+        ), upd AS (
+            UPDATE clients c
+            SET views_used = c.views_used + 1,
+                window_expires_at = now() + make_interval(hours => {HTML_VALID_HOURS})
+            FROM cur
+            WHERE c.client_id = cur.client_id
+              AND cur.has_payload
+              AND (c.window_expires_at IS NULL OR now() > c.window_expires_at)
+              AND c.views_used < {MAX_VIEWS}
+              AND now() <= c.trial_start + make_interval(days => {TRIAL_DAYS})
+            RETURNING c.views_used, c.window_expires_at
+        )
+        SELECT cur.trial_start, cur.has_payload,
+               COALESCE(upd.views_used, cur.views_used) AS views_used,
+               COALESCE(upd.window_expires_at, cur.window_expires_at) AS window_expires_at,
+               upd.views_used IS NOT NULL AS refreshed,
+               now() <= cur.trial_start + make_interval(days => {TRIAL_DAYS}) AS trial_active,
+               (cur.window_expires_at > now()) IS TRUE AS window_open
+        FROM cur
+        LEFT JOIN upd ON true
+    """,
+    "client_upsert": """
+        INSERT INTO clients (client_id, password_hash, trial_start, views_used, window_expires_at)
+        VALUES ($1, $2, now(), 0, NULL)
+        ON CONFLICT (client_id)
+        DO UPDATE SET password_hash = EXCLUDED.password_hash
+        WHERE EXCLUDED.password_hash IS NOT NULL
+    """,
+    "payload_upsert": """
+        INSERT INTO payloads (
+            client_id, payload_json, updated_at,
+            excel_filename, excel_b64, excel_data, excel_sha256, excel_size
+        )
+        VALUES ($1, $2::jsonb, now(), $3, NULL, $4, $5, $6)
+        ON CONFLICT (client_id)
+        DO UPDATE SET
+            payload_json = EXCLUDED.payload_json,
+            updated_at = EXCLUDED.updated_at,
+            excel_filename = EXCLUDED.excel_filename,
+            excel_b64 = NULL,
+            excel_data = EXCLUDED.excel_data,
+            excel_sha256 = EXCLUDED.excel_sha256,
+            excel_size = EXCLUDED.excel_size
+    """,
+}
+
+
+# Cold-path statements (not worth a per-connection PREPARE)
+SQL_CLIENT_WINDOW = """
+    SELECT views_used, window_expires_at, (window_expires_at > now()) IS TRUE AS window_open
+    FROM clients
+    WHERE client_id=%s;
+"""
+SQL_SET_PASSWORD_HASH = "UPDATE clients SET password_hash = %s WHERE client_id = %s;"
+SQL_EXCEL_FETCH = """
+    SELECT excel_filename, excel_data, excel_b64, excel_sha256, updated_at
+    FROM payloads
+    WHERE client_id=%s;
+"""
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Pooled connection that remembers whether PREPARED_STATEMENTS ran on it"""
+    prepared = False
+
 
-_pool: SimpleConnectionPool | None = None
+# ---- Schema bootstrap (once per process) ----
+_db_ready = False
+_db_lock = threading.Lock()
 
 
 # -------------------- Helpers --------------------
-def utc_now() -> datetime:
-    return datetime.now(timezone.utc)
+_UTC = timezone.utc
 
 
 def iso(dt: datetime) -> str:
-    return dt.astimezone(timezone.utc).isoformat()
+    return dt.astimezone(_UTC).isoformat()
 
 
-def parse_iso(s: str | None) -> datetime | None:
-    if not s:
-        return None
-    return datetime.fromisoformat(s)
+def password_too_long(password: str) -> bool:
+    return len(password.encode()) > BCRYPT_MAX_BYTES
 
 
 def hash_password(password: str) -> str:
-    """Simple SHA256 hash for passwords"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Salted bcrypt hash for passwords"""
+    salt = bcrypt.gensalt(rounds=BCRYPT_COST)
+    return bcrypt.hashpw(password.encode(), salt).decode()
+
+
+def is_legacy_hash(hashed: str) -> bool:
+    """Old rows store an unsalted SHA256 hex digest instead of bcrypt"""
+    return not hashed.startswith("$2")
+
+
+def password_mac(password: str, hashed: str) -> str:
+    """Cache key for a verify result: HMAC under SECRET_KEY, so it is useless for offline guessing"""
+    msg = hashed.encode() + b"\0" + password.encode()
+    return hmac.new(app.secret_key.encode(), msg, "sha256").hexdigest()
 
 
 def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hash"""
-    return hash_password(password) == hashed
+    """Verify password against hash (bcrypt, or legacy SHA256)"""
+    key = (hashed, password_mac(password, hashed))
+    with _verify_lock:
+        cached = _verify_cache.get(key)
+        if cached is not None:
+            _verify_cache.move_to_end(key)
+            return cached
+
+    if is_legacy_hash(hashed):
+        ok = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
+    else:
+        try:
+            ok = _verify_bcrypt_shared(password, hashed)
+        except ValueError:  # over-long password or malformed stored hash
+            ok = False
+
+    with _verify_lock:
+        _verify_cache[key] = ok
+        if len(_verify_cache) > VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+    return ok
+
+
+def get_redis() -> redis.Redis | None:
+    global _redis
+    if _redis is None and REDIS_URL:
+        _redis = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis
+
+
+def _verify_bcrypt_shared(password: str, hashed: str) -> bool:
+    """bcrypt check backed by Redis so results survive restarts and are shared by workers"""
+    r = get_redis()
+    if r is None:
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+
+    # Keyed on the stored hash, so a password change invalidates old entries
+    rkey = "pwok:" + password_mac(password, hashed)
+    try:
+        cached = r.get(rkey)
+        if cached is not None:
+            return cached == b"1"
+    except redis.RedisError:
+        pass
+
+    ok = bcrypt.checkpw(password.encode(), hashed.encode())
+    try:
+        r.setex(rkey, VERIFY_CACHE_TTL, b"1" if ok else b"0")
+    except redis.RedisError:
+        pass
+    return ok
+
+
+def is_authenticated(client_id: str) -> bool:
+    """Check the signed per-client auth cookie set by login_submit"""
+    token = request.cookies.get(g.auth_key)
+    if not token:
+        return False
+    try:
+        return _auth_serializer.loads(token, max_age=AUTH_MAX_AGE) == client_id
+    except BadSignature:
+        return False
+
+
+def login_redirect(client_id: str):
+    """Redirect to the dashboard with a fresh signed auth cookie"""
+    resp = redirect(url_for("report_page", client_id=client_id))
+    resp.set_cookie(
+        g.auth_key,
+        _auth_serializer.dumps(client_id),
+        max_age=AUTH_MAX_AGE,
+        httponly=True,
+        secure=AUTH_COOKIE_SECURE,
+        samesite="Lax",
+    )
+    return resp
 
 
 def require_api_key():
@@ -70,23 +343,47 @@ def require_api_key():
         abort(403, description="Unauthorized")
 
 
-def get_pool() -> SimpleConnectionPool:
+def get_pool() -> ThreadedConnectionPool:
     global _pool
     if _pool is None:
-        if not DATABASE_URL:
-            raise RuntimeError("DATABASE_URL not configured")
-        _pool = SimpleConnectionPool(
-            POOL_MIN,
-            POOL_MAX,
-            dsn=DATABASE_URL,
-            cursor_factory=psycopg2.extras.RealDictCursor,
-        )
+        with _pool_lock:
+            if _pool is None:
+                if not DATABASE_URL:
+                    raise RuntimeError("DATABASE_URL not configured")
+                pool = ThreadedConnectionPool(
+                    POOL_MIN,
+                    POOL_MAX,
+                    dsn=DATABASE_URL,
+                    options="-c timezone=UTC",
+                    connection_factory=PreparedConnection,
+                    cursor_factory=psycopg2.extras.RealDictCursor,
+                )
+                atexit.register(pool.closeall)
+                _pool = pool
     return _pool
 
 
+def prepare_statements(conn):
+    """PREPARE the hot-path queries so they are parsed and planned once per connection"""
+    with conn.cursor() as cur:
+        # All of them in one round-trip
+        cur.execute("".join(f"PREPARE {name} AS {sql};" for name, sql in PREPARED_STATEMENTS.items()))
+    conn.commit()
+    conn.prepared = True
+
+
 def db_conn():
+    if not _db_ready:
+        ensure_db_ready()
     pool = get_pool()
-    return pool.getconn()
+    conn = pool.getconn()
+    if not conn.prepared:
+        try:
+            prepare_statements(conn)
+        except Exception:
+            pool.putconn(conn, close=True)
+            raise
+    return conn
 
 
 def db_putconn(conn):
@@ -94,12 +391,56 @@ def db_putconn(conn):
     pool.putconn(conn)
 
 
+def get_db():
+    """Pooled connection for the current request (checked out once, returned at teardown)"""
+    if "db" not in g:
+        g.db = db_conn()
+    return g.db
+
+
+@app.teardown_appcontext
+def _release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        db_putconn(conn)  # the pool rolls back anything left uncommitted
+
+
 def init_db():
     """Create tables with password support"""
     conn = None
     try:
-        conn = db_conn()
+        # Raw pool checkout: the prepared statements need these tables to exist
+        conn = get_pool().getconn()
         with conn.cursor() as cur:
+            # Existing columns, so migrations only run when still needed: every
+            # ALTER TABLE takes ACCESS EXCLUSIVE, even one that turns out a no-op
+            cur.execute("""
+                SELECT attrelid::regclass::text AS table_name, attname, attstorage
+                FROM pg_attribute
+                WHERE attrelid IN (to_regclass('clients'), to_regclass('payloads'))
+                  AND attnum > 0 AND NOT attisdropped
+            """)
+            columns = {"clients": {}, "payloads": {}}
+            for row in cur.fetchall():
+                columns[row["table_name"]][row["attname"]] = row["attstorage"]
+            payload_columns = columns["payloads"]
+
+            # Columns added after the first release, for tables created by older versions
+            added_columns = [
+                ("clients", "password_hash", "TEXT"),
+                ("payloads", "excel_filename", "TEXT"),
+                ("payloads", "excel_b64", "TEXT"),
+                ("payloads", "excel_data", "BYTEA"),
+                ("payloads", "excel_sha256", "TEXT"),
+                ("payloads", "excel_size", "INTEGER"),
+            ]
+            migrations = "".join(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {type_};"
+                for table, column, type_ in added_columns
+                if column not in columns[table]
+            )
+
+            # Whole schema check in one round-trip
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS clients (
                     client_id TEXT PRIMARY KEY,
@@ -108,112 +449,197 @@ def init_db():
                     views_used INTEGER NOT NULL DEFAULT 0,
                     window_expires_at TIMESTAMPTZ
                 );
-            """)
-            
-            cur.execute("""
+
                 CREATE TABLE IF NOT EXISTS payloads (
                     client_id TEXT PRIMARY KEY,
                     payload_json JSONB NOT NULL,
                     updated_at TIMESTAMPTZ NOT NULL,
                     excel_filename TEXT,
-                    excel_b64 TEXT
+                    excel_b64 TEXT,
+                    excel_data BYTEA,
+                    excel_sha256 TEXT,
+                    excel_size INTEGER
                 );
-            """)
-            
-            # Add password_hash column if it doesn't exist
-            cur.execute("""
-                DO $$ 
-                BEGIN
-                    BEGIN
-                        ALTER TABLE clients ADD COLUMN password_hash TEXT;
-                    EXCEPTION
-                        WHEN duplicate_column THEN NULL;
-                    END;
-                    BEGIN
-                        ALTER TABLE payloads ADD COLUMN excel_filename TEXT;
-                    EXCEPTION
-                        WHEN duplicate_column THEN NULL;
-                    END;
-                    BEGIN
-                        ALTER TABLE payloads ADD COLUMN excel_b64 TEXT;
-                    EXCEPTION
-                        WHEN duplicate_column THEN NULL;
-                    END;
-                END $$;
-            """)
-            
+            """ + migrations)
+
+            if payload_columns.get("excel_data") != "e":
+                # xlsx files are already zip-compressed: store out of line without
+                # spending CPU on a TOAST compression pass that cannot win
+                cur.execute("ALTER TABLE payloads ALTER COLUMN excel_data SET STORAGE EXTERNAL;")
+
+            if "year" in payload_columns:
+                # Short-lived column; the year is only ever read from payload_json
+                cur.execute("ALTER TABLE payloads DROP COLUMN year;")
+
+            # lz4 TOAST compression (PG 14+, if built in) is much faster than
+            # pglz to read and write for the large, repetitive JSONB payloads
+            if conn.server_version >= 140000:
+                cur.execute("""
+                    SELECT 1 FROM pg_attribute a, pg_settings s
+                    WHERE a.attrelid = 'payloads'::regclass AND a.attname = 'payload_json'
+                      AND a.attcompression <> 'l'
+                      AND s.name = 'default_toast_compression' AND 'lz4' = ANY(s.enumvals)
+                """)
+                if cur.fetchone():
+                    cur.execute("ALTER TABLE payloads ALTER COLUMN payload_json SET COMPRESSION lz4;")
+
         conn.commit()
     finally:
         if conn is not None:
             db_putconn(conn)
 
 
-@app.before_request
-def _ensure_db_ready():
-    init_db()
+def ensure_db_ready():
+    """Run init_db() once per process"""
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_lock:
+        if not _db_ready:
+            init_db()
+            _db_ready = True
 
 
-# -------------------- Trial logic --------------------
-def trial_is_active(trial_start: datetime) -> bool:
-    return utc_now() <= (trial_start + timedelta(days=TRIAL_DAYS))
+@app.cli.command("init-db")
+def init_db_command():
+    """Create or migrate the database schema"""
+    init_db()
+    migrate_db()
+    click.echo("Database initialized")
 
 
-def ensure_access_window(client_id: str) -> tuple[bool, str, dict | None]:
-    """Ensures valid 24h access window"""
-    conn = None
+def migrate_db():
+    """One-time data migrations (full-table scans), run by `flask init-db` before each deploy"""
+    conn = get_pool().getconn()
     try:
-        conn = db_conn()
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM clients WHERE client_id=%s", (client_id,))
-            row = cur.fetchone()
-            if not row:
-                return False, "No client", None
+            # Older versions stored the plaintext push password inside payload_json
+            cur.execute("UPDATE payloads SET payload_json = payload_json - 'password' WHERE payload_json ? 'password';")
+        conn.commit()
+    finally:
+        db_putconn(conn)
 
-            trial_start = row["trial_start"]
-            if isinstance(trial_start, str):
-                trial_start = parse_iso(trial_start)
-            if not trial_start or not trial_is_active(trial_start):
-                return False, "Trial ended", row
 
-            now = utc_now()
-            window_exp = row.get("window_expires_at")
-            if isinstance(window_exp, str):
-                window_exp = parse_iso(window_exp)
+if DATABASE_URL:
+    # Don't let an unreachable DB at boot break the import; db_conn() retries lazily
+    try:
+        ensure_db_ready()
+    except Exception:
+        app.logger.exception("init_db failed at startup; will retry on first DB use")
 
-            if (window_exp is None) or (now > window_exp):
-                if row["views_used"] >= MAX_VIEWS:
-                    return False, "Trial limit reached", row
 
-                new_exp = now + timedelta(hours=HTML_VALID_HOURS)
-                cur.execute("""
-                    UPDATE clients
-                    SET views_used = views_used + 1,
-                        window_expires_at = %s
-                    WHERE client_id = %s
-                    RETURNING *;
-                """, (new_exp, client_id))
-                conn.commit()
-                updated = cur.fetchone()
-                return True, "OK", updated
+# -------------------- Trial logic --------------------
+# Time comparisons run in SQL (trial_active / window_open columns) against the
+# DB clock, so the request path does no datetime arithmetic in Python.
+def ensure_access_window(client_id: str) -> tuple[bool, str, dict | None]:
+    """Ensures valid 24h access window
 
+    One statement loads the client (with payload presence) and, only
+    if the window has lapsed and quota remains, opens a new one atomically.
+    """
+    conn = get_db()
+    with conn.cursor() as cur:
+        cur.execute("EXECUTE page_access(%s);", (client_id,))
+        row = cur.fetchone()
+        if not row:
+            return False, "No client", None
+        if row["refreshed"]:
+            conn.commit()
             return True, "OK", row
-    finally:
-        if conn is not None:
-            db_putconn(conn)
 
+        if not row["trial_active"]:
+            return False, "Trial ended", row
 
-def require_active_window_or_403(client_id: str):
-    allowed, msg, row = ensure_access_window(client_id)
-    if not allowed:
-        abort(403, description=msg)
-    return row
+        if row["window_open"]:
+            return True, "OK", row
+
+        if row["views_used"] >= MAX_VIEWS or not row["has_payload"]:
+            return False, "Trial limit reached", row
+
+        # Lost a race with a concurrent refresh of the same window: re-read it
+        cur.execute(SQL_CLIENT_WINDOW, (client_id,))
+        fresh = cur.fetchone()
+        if fresh and fresh["window_open"]:
+            return True, "OK", {**row, **fresh}
+        return False, "Trial limit reached", row
+
+
+def cache_payload(client_id: str, entry: CachedPayload):
+    """Store a serialized payload, evicting least recently used entries past either cap"""
+    global _payload_cache_bytes
+    if len(entry.data_json) > PAYLOAD_CACHE_BYTES:
+        return
+    with _payload_lock:
+        old = _payload_cache.pop(client_id, None)
+        if old is not None:
+            _payload_cache_bytes -= len(old.data_json)
+        _payload_cache[client_id] = entry
+        _payload_cache_bytes += len(entry.data_json)
+        while len(_payload_cache) > PAYLOAD_CACHE_SIZE or _payload_cache_bytes > PAYLOAD_CACHE_BYTES:
+            _, evicted = _payload_cache.popitem(last=False)
+            _payload_cache_bytes -= len(evicted.data_json)
+
+
+def drop_cached_payload(client_id: str):
+    global _payload_cache_bytes
+    with _payload_lock:
+        old = _payload_cache.pop(client_id, None)
+        if old is not None:
+            _payload_cache_bytes -= len(old.data_json)
+
+
+def report_etag(client_id: str, updated_at, client: dict) -> str:
+    """Version tag for /api/report: changes with the payload or the trial state"""
+    version = f"{client_id}|{updated_at}|{client['window_expires_at']}|{client['views_used']}|{MAX_VIEWS}"
+    return hashlib.sha256(version.encode()).hexdigest()
+
+
+def require_report_access(cur, client_id: str) -> dict:
+    """Read-only access check for the API: trial active and window open (no view consumed)"""
+    # Verify client and look up payload version in one round-trip
+    cur.execute("EXECUTE report_lookup(%s);", (client_id,))
+    client = cur.fetchone()
+    if not client:
+        abort(404)
+
+    if not client["trial_active"]:
+        abort(403, description="Trial ended")
+
+    if not client["window_open"]:
+        abort(403, description="Access window expired")
+
+    return client
+
+
+@lru_cache(maxsize=256)
+def render_dashboard(client_id: str) -> str:
+    """Rendered dashboard HTML, memoized: the page is a shell that only varies by client_id
+    (trial state and data come from /api/report)"""
+    return render_template(
+        "dashboard.html",  # CHANGED: from report.html
+        client_id=client_id,
+        page='dashboard',  # NEW: for navigation
+    )
 
 
 # -------------------- Routes --------------------
+@app.url_value_preprocessor
+def _normalize_client_id(endpoint, values):
+    """Strip and validate <client_id> once, before any DB work"""
+    if not values or "client_id" not in values:
+        return
+    client_id = values["client_id"].strip()
+    if not CLIENT_ID_RE.match(client_id):
+        abort(400, description="Invalid client_id")
+    values["client_id"] = client_id
+    g.auth_key = "rpt_" + client_id
+
+
 @app.get("/health")
 def health():
     try:
-        init_db()
+        with get_db().cursor() as cur:
+            cur.execute("SELECT 1;")
         return {"ok": True}
     except Exception as e:
         return {"ok": False, "error": str(e)}, 500
@@ -230,6 +656,7 @@ def home():
             "report_login": "/report/<client_id>/login",
             "report_page": "/report/<client_id> (requires auth)",
             "report_api": "/api/report/<client_id> (requires auth)",
+            "report_excel": "/api/report/<client_id>/excel (requires auth)",
         }
     }
 
@@ -251,62 +678,75 @@ def push_data():
     """
     require_api_key()
 
-    payload = request.get_json(force=True) or {}
+    # Read the body rather than trusting Content-Length: chunked uploads have none
+    body = request.get_data(cache=False)
+    try:
+        payload = orjson.loads(body) if body else {}
+    except orjson.JSONDecodeError:
+        return jsonify({"ok": False, "error": "body must be valid JSON"}), 400
+    if not isinstance(payload, dict):
+        return jsonify({"ok": False, "error": "body must be a JSON object"}), 400
     client_id = str(payload.get("client_id", "")).strip()
     if not client_id:
         return jsonify({"ok": False, "error": "client_id required"}), 400
+    if not CLIENT_ID_RE.match(client_id):
+        return jsonify({"ok": False, "error": "client_id must match [A-Za-z0-9_-]{1,64}"}), 400
 
     data = payload.get("data", None)
     if not isinstance(data, dict):
         return jsonify({"ok": False, "error": "data must be object/dict"}), 400
 
-    # Optional password
-    password = payload.get("password")
-    password_hash = hash_password(password) if password else None
-
-    # Optional Excel
-    excel_filename = payload.get("excel_filename")
-    excel_b64 = payload.get("excel_b64")
-
-    now = utc_now()
-
-    conn = None
-    try:
-        conn = db_conn()
-        with conn.cursor() as cur:
-            # Check if client exists
-            cur.execute("SELECT client_id, password_hash FROM clients WHERE client_id=%s", (client_id,))
-            existing = cur.fetchone()
-            
-            if not existing:
-                # New client
-                cur.execute("""
-                    INSERT INTO clients (client_id, password_hash, trial_start, views_used, window_expires_at)
-                    VALUES (%s, %s, %s, 0, NULL);
-                """, (client_id, password_hash, now))
-            else:
-                # Existing client - update password if provided
-                if password_hash:
-                    cur.execute("""
-                        UPDATE clients SET password_hash = %s WHERE client_id = %s;
-                    """, (password_hash, client_id))
-
-            # Upsert payload
-            cur.execute("""
-                INSERT INTO payloads (client_id, payload_json, updated_at, excel_filename, excel_b64)
-                VALUES (%s, %s::jsonb, %s, %s, %s)
-                ON CONFLICT (client_id)
-                DO UPDATE SET 
-                    payload_json = EXCLUDED.payload_json, 
-                    updated_at = EXCLUDED.updated_at,
-                    excel_filename = EXCLUDED.excel_filename,
-                    excel_b64 = EXCLUDED.excel_b64;
-            """, (client_id, json.dumps(payload, ensure_ascii=False), now, excel_filename, excel_b64))
-
-        conn.commit()
-    finally:
-        if conn is not None:
-            db_putconn(conn)
+    # Optional password: hashed into clients, never stored with the payload
+    password = payload.pop("password", None)
+    if password is not None and not isinstance(password, str):
+        return jsonify({"ok": False, "error": "password must be a string"}), 400
+    if password and password_too_long(password):
+        return jsonify({"ok": False, "error": f"password must be at most {BCRYPT_MAX_BYTES} bytes"}), 400
+
+    # Optional Excel (stored as raw bytes, not base64 text)
+    excel_filename = payload.pop("excel_filename", None)
+    excel_b64 = payload.pop("excel_b64", None)
+    if excel_filename is not None and not isinstance(excel_filename, str):
+        return jsonify({"ok": False, "error": "excel_filename must be a string"}), 400
+    if excel_b64 is not None and not isinstance(excel_b64, str):
+        return jsonify({"ok": False, "error": "excel_b64 must be valid base64"}), 400
+    excel_data = excel_sha256 = excel_size = None
+    if excel_b64:
+        try:
+            excel_data = base64.b64decode(excel_b64)
+        except (binascii.Error, ValueError):
+            return jsonify({"ok": False, "error": "excel_b64 must be valid base64"}), 400
+        excel_sha256 = hashlib.sha256(excel_data).hexdigest()
+        excel_size = len(excel_data)
+
+    conn = get_db()
+    with conn.cursor() as cur:
+        # Re-pushing the same password is the common case: keep the stored hash
+        # (and every cached verify result for it) instead of paying bcrypt again
+        password_hash = None
+        if password:
+            cur.execute("EXECUTE client_password(%s);", (client_id,))
+            row = cur.fetchone()
+            stored = row["password_hash"] if row else None
+            if not stored or is_legacy_hash(stored) or not verify_password(password, stored):
+                password_hash = hash_password(password)
+
+        # Upsert client (keep existing password unless a new one is provided)
+        # and payload in a single round-trip
+        sync_sql = "SET LOCAL synchronous_commit TO OFF;" if PUSH_ASYNC_COMMIT else ""
+        cur.execute(sync_sql + """
+            EXECUTE client_upsert(%s, %s);
+            EXECUTE payload_upsert(%s, %s, %s, %s, %s, %s);
+        """, (
+            client_id, password_hash,
+            client_id, orjson.dumps(payload).decode(),
+            excel_filename, psycopg2.Binary(excel_data) if excel_data is not None else None,
+            excel_sha256, excel_size,
+        ))
+
+    conn.commit()
+
+    drop_cached_payload(client_id)
 
     return jsonify({"ok": True, "public_path": f"/report/{client_id}"})
 
@@ -314,115 +754,73 @@ def push_data():
 @app.get("/report/<client_id>/login")
 def login_page(client_id: str):
     """Login page for client"""
-    client_id = client_id.strip()
     return render_template("login.html", client_id=client_id)
 
 
 @app.post("/report/<client_id>/login")
 def login_submit(client_id: str):
     """Process login"""
-    client_id = client_id.strip()
     password = request.form.get("password", "")
 
-    conn = None
-    try:
-        conn = db_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT password_hash FROM clients WHERE client_id=%s", (client_id,))
-            row = cur.fetchone()
-            
-            if not row:
-                return render_template("login.html", client_id=client_id, error="Client not found")
-            
-            # Check password
-            stored_hash = row["password_hash"]
-            
-            # If no password set, allow access (backward compatibility)
-            if not stored_hash:
-                session[f"auth_{client_id}"] = True
-                return redirect(url_for("report_page", client_id=client_id))
+    conn = get_db()
+    with conn.cursor() as cur:
+        cur.execute("EXECUTE client_password(%s);", (client_id,))
+        row = cur.fetchone()
+        
+        if not row:
+            return render_template("login.html", client_id=client_id, error="Client not found")
+        
+        # Check password
+        stored_hash = row["password_hash"]
+        
+        # If no password set, allow access (backward compatibility)
+        if not stored_hash:
+            return login_redirect(client_id)
+        
+        # Verify password (bcrypt cannot check past 72 bytes, so those never match)
+        if not password_too_long(password) and verify_password(password, stored_hash):
+            # Upgrade legacy SHA256 hashes to bcrypt on successful login
+            if is_legacy_hash(stored_hash):
+                cur.execute(SQL_SET_PASSWORD_HASH, (hash_password(password), client_id))
+                conn.commit()
+            return login_redirect(client_id)
+        else:
+            return render_template("login.html", client_id=client_id, error="Incorrect password")
             
-            # Verify password
-            if verify_password(password, stored_hash):
-                session[f"auth_{client_id}"] = True
-                return redirect(url_for("report_page", client_id=client_id))
-            else:
-                return render_template("login.html", client_id=client_id, error="Incorrect password")
-                
-    finally:
-        if conn is not None:
-            db_putconn(conn)
 
 
 @app.get("/report/<client_id>")
 def report_page(client_id: str):
     """Dashboard page - requires authentication"""
-    client_id = client_id.strip()
 
     # Check authentication
-    if not session.get(f"auth_{client_id}"):
+    if not is_authenticated(client_id):
         return redirect(url_for("login_page", client_id=client_id))
 
-    # Check payload exists
-    conn = None
-    try:
-        conn = db_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT payload_json FROM payloads WHERE client_id=%s", (client_id,))
-            prow = cur.fetchone()
-            if not prow:
-                return "No data available. Please contact provider.", 404
-    finally:
-        if conn is not None:
-            db_putconn(conn)
+    # Check payload exists and enforce window/view logic in one round-trip
+    allowed, msg, row = ensure_access_window(client_id)
+    if not row or not row["has_payload"]:
+        return "No data available. Please contact provider.", 404
+    if not allowed:
+        abort(403, description=msg)
 
-    # Enforce window/view logic
-    row = require_active_window_or_403(client_id)
-
-    year = None
-    try:
-        payload = prow["payload_json"]
-        if isinstance(payload, str):
-            payload = json.loads(payload)
-        year = payload.get("year")
-    except Exception:
-        year = None
-
-    return render_template(
-        "dashboard.html",  # CHANGED: from report.html
-        client_id=client_id,
-        page='dashboard',  # NEW: for navigation
-        year=year or "",
-        window_expires_at=iso(row["window_expires_at"]) if row.get("window_expires_at") else "",
-        views_used=row.get("views_used", 0),
-        max_views=MAX_VIEWS
-    )
+    return render_dashboard(client_id)
 
 
 @app.get("/report/<client_id>/charts")
 def charts_page(client_id: str):
     """Charts visualization page"""
-    client_id = client_id.strip()
 
     # Check authentication
-    if not session.get(f"auth_{client_id}"):
+    if not is_authenticated(client_id):
         return redirect(url_for("login_page", client_id=client_id))
 
-    # Check payload exists
-    conn = None
-    try:
-        conn = db_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT payload_json FROM payloads WHERE client_id=%s", (client_id,))
-            prow = cur.fetchone()
-            if not prow:
-                return "No data available. Please contact provider.", 404
-    finally:
-        if conn is not None:
-            db_putconn(conn)
-
-    # Enforce window/view logic
-    row = require_active_window_or_403(client_id)
+    # Check payload exists and enforce window/view logic in one round-trip
+    allowed, msg, row = ensure_access_window(client_id)
+    if not row or not row["has_payload"]:
+        return "No data available. Please contact provider.", 404
+    if not allowed:
+        abort(403, description=msg)
 
     return render_template(
         "charts.html",
@@ -434,27 +832,17 @@ def charts_page(client_id: str):
 @app.get("/report/<client_id>/compare")
 def compare_page(client_id: str):
     """Monthly comparison page"""
-    client_id = client_id.strip()
 
     # Check authentication
-    if not session.get(f"auth_{client_id}"):
+    if not is_authenticated(client_id):
         return redirect(url_for("login_page", client_id=client_id))
 
-    # Check payload exists
-    conn = None
-    try:
-        conn = db_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT payload_json FROM payloads WHERE client_id=%s", (client_id,))
-            prow = cur.fetchone()
-            if not prow:
-                return "No data available. Please contact provider.", 404
-    finally:
-        if conn is not None:
-            db_putconn(conn)
-
-    # Enforce window/view logic
-    row = require_active_window_or_403(client_id)
+    # Check payload exists and enforce window/view logic in one round-trip
+    allowed, msg, row = ensure_access_window(client_id)
+    if not row or not row["has_payload"]:
+        return "No data available. Please contact provider.", 404
+    if not allowed:
+        abort(403, description=msg)
 
     return render_template(
         "compare.html",
@@ -466,10 +854,9 @@ def compare_page(client_id: str):
 @app.get("/report/<client_id>/debug")
 def debug_page(client_id: str):
     """Debug page - shows raw API data"""
-    client_id = client_id.strip()
 
     # Check authentication
-    if not session.get(f"auth_{client_id}"):
+    if not is_authenticated(client_id):
         return redirect(url_for("login_page", client_id=client_id))
 
     return render_template(
@@ -482,49 +869,47 @@ def debug_page(client_id: str):
 @app.get("/report/<client_id>/logout")
 def logout(client_id: str):
     """Logout"""
-    client_id = client_id.strip()
-    session.pop(f"auth_{client_id}", None)
-    return redirect(url_for("login_page", client_id=client_id))
+    resp = redirect(url_for("login_page", client_id=client_id))
+    resp.delete_cookie(g.auth_key)
+    return resp
 
 
 @app.get("/api/report/<client_id>")
 def report_api(client_id: str):
     """API endpoint - requires authentication"""
-    client_id = client_id.strip()
 
     # Check authentication
-    if not session.get(f"auth_{client_id}"):
+    if not is_authenticated(client_id):
         abort(401, description="Not authenticated")
 
-    conn = None
-    try:
-        conn = db_conn()
-        with conn.cursor() as cur:
-            # Verify client
-            cur.execute("SELECT * FROM clients WHERE client_id=%s", (client_id,))
-            client = cur.fetchone()
-            if not client:
-                abort(404)
-
-            trial_start = client["trial_start"]
-            if isinstance(trial_start, str):
-                trial_start = parse_iso(trial_start)
-            if not trial_start or not trial_is_active(trial_start):
-                abort(403, description="Trial ended")
-
-            window_exp = client.get("window_expires_at")
-            if isinstance(window_exp, str):
-                window_exp = parse_iso(window_exp)
-
-            if (window_exp is None) or (utc_now() > window_exp):
-                abort(403, description="Access window expired")
-
-            # Get payload
-            cur.execute("""
-                SELECT payload_json, updated_at, excel_filename, excel_b64 
-                FROM payloads 
-                WHERE client_id=%s
-            """, (client_id,))
+    conn = get_db()
+    with conn.cursor() as cur:
+        client = require_report_access(cur, client_id)
+        window_exp = client["window_expires_at"]
+
+        # Get payload (only pull the big row when the cached copy is stale)
+        updated_at = client["updated_at"]
+        if updated_at is None:
+            abort(404)
+
+        # Conditional GET: the body only changes with the payload version or trial state
+        etag = report_etag(client_id, updated_at, client)
+        if request.if_none_match.contains(etag):
+            resp = app.response_class(status=304)
+            resp.set_etag(etag)
+            resp.cache_control.private = True
+            resp.cache_control.no_cache = True
+            return resp
+
+        with _payload_lock:
+            cached = _payload_cache.get(client_id)
+            if cached is not None:
+                _payload_cache.move_to_end(client_id)
+
+        if cached is not None and cached.updated_at == updated_at:
+            _, year, data_json, excel_filename, has_excel = cached
+        else:
+            cur.execute("EXECUTE payload_fetch(%s);", (client_id,))
             row = cur.fetchone()
             if not row:
                 abort(404)
@@ -532,30 +917,21 @@ def report_api(client_id: str):
             payload = row["payload_json"]
             updated_at = row["updated_at"]
             excel_filename = row.get("excel_filename")
-            excel_b64 = row.get("excel_b64")
-
-    finally:
-        if conn is not None:
-            db_putconn(conn)
+            has_excel = row["has_excel"]
+            year = payload.get("year", "")
 
-    # Format response
-    try:
-        if isinstance(updated_at, str):
-            updated_dt = parse_iso(updated_at) or utc_now()
-        else:
-            updated_dt = updated_at
-        updated_str = updated_dt.astimezone(timezone.utc).strftime("%d/%m/%Y %H:%M UTC")
-    except Exception:
-        updated_str = str(updated_at)
+            # Serialize the large part of the body once per payload version
+            data_json = (
+                b'"data":' + orjson.dumps(payload.get("data", {}))
+                + b',"monthly_data":' + orjson.dumps(payload.get("monthly_data", {}))  # 📊 monthly data from payload
+            )
 
-    if isinstance(payload, str):
-        payload = json.loads(payload)
+            cache_payload(client_id, CachedPayload(updated_at, year, data_json, excel_filename, has_excel))
 
-    data = payload.get("data", {})
-    year = payload.get("year", "")
-    monthly_data = payload.get("monthly_data", {})  # 📊 NEW: Get monthly data from payload
+    # Format response; sessions run with timezone=UTC (see get_pool), so no astimezone() copy is needed
+    updated_str = updated_at.strftime("%d/%m/%Y %H:%M UTC")
 
-    response = {
+    head = {
         "client": client_id,
         "year": year,
         "updated_at": updated_str,
@@ -564,16 +940,58 @@ def report_api(client_id: str):
             "views_used": client.get("views_used", 0),
             "views_max": MAX_VIEWS
         },
-        "data": data,
-        "monthly_data": monthly_data  # 📊 NEW: Include in response
     }
 
-    # Add Excel if available
-    if excel_filename and excel_b64:
-        response["excel_filename"] = excel_filename
-        response["excel_b64"] = excel_b64
+    # Excel is downloaded separately, on demand
+    if excel_filename and has_excel:
+        head["excel_filename"] = excel_filename
+        head["excel_url"] = url_for("excel_download", client_id=client_id)
+
+    # Small per-request head + cached "data"/"monthly_data" fragment; passed as a
+    # list so the (possibly multi-MB) fragment is written out without being copied
+    head_json = orjson.dumps(head)
+    resp = app.response_class([head_json[:-1], b",", data_json, b"}"], mimetype="application/json")
+    resp.set_etag(report_etag(client_id, updated_at, client))
+    resp.last_modified = updated_at
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
 
-    return jsonify(response)
+
+@app.get("/api/report/<client_id>/excel")
+def excel_download(client_id: str):
+    """Excel download - requires authentication (supports ETag and Range)"""
+
+    # Check authentication
+    if not is_authenticated(client_id):
+        abort(401, description="Not authenticated")
+
+    conn = get_db()
+    with conn.cursor() as cur:
+        require_report_access(cur, client_id)
+
+        cur.execute(SQL_EXCEL_FETCH, (client_id,))
+        row = cur.fetchone()
+
+    if not row or not row["excel_filename"]:
+        abort(404)
+    if row["excel_data"] is not None:
+        body = bytes(row["excel_data"])
+    elif row["excel_b64"]:
+        body = base64.b64decode(row["excel_b64"])  # legacy rows
+    else:
+        abort(404)
+
+    return send_file(
+        BytesIO(body),
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=row["excel_filename"],
+        conditional=True,
+        etag=row["excel_sha256"] or hashlib.sha256(body).hexdigest(),
+        last_modified=row["updated_at"],
+        max_age=0,
+    )
 
 
 if __name__ == "__main__":
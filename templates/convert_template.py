@@ -4,74 +4,68 @@ Automatic conversion of report.html to dashboard.html with base template
 Usage: python convert_template.py
 """
 
+import re
+from pathlib import Path
+
+
+# Single pass over the report: the <style> block, the <body> content up to the
+# script (or </body>), and everything from the first <script> to the last </script>
+SECTIONS_RE = re.compile(
+    r'(?P<style><style>.*?</style>)'
+    r'|<body>(?P<body>.*?)(?=<script>|</body>)'
+    r'|(?P<script><script>.*</script>)',
+    re.DOTALL,
+)
+
+
 def convert_report_to_dashboard(input_file='report.html', output_file='dashboard.html'):
     """Convert standalone report.html to template-based dashboard.html"""
     
     print(f"🔄 Converting {input_file} to {output_file}...")
     
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = Path(input_file).read_text(encoding='utf-8')
     except FileNotFoundError:
         print(f"❌ Error: {input_file} not found!")
         print(f"   Make sure {input_file} is in the current directory")
         return False
     
-    # Extract CSS section
-    css_start = content.find('<style>')
-    css_end = content.find('</style>') + len('</style>')
+    # Extract CSS, body and script sections (first match of each wins)
+    sections = {}
+    for match in SECTIONS_RE.finditer(content):
+        sections.setdefault(match.lastgroup, match.group(match.lastgroup))
     
-    if css_start == -1 or css_end == -1:
+    css_block = sections.get('style')
+    if css_block is None:
         print("❌ Error: Could not find <style> section")
         return False
-    
-    css_block = content[css_start:css_end]
     print(f"✅ Extracted CSS block ({len(css_block)} characters)")
     
-    # Extract body content
-    body_start = content.find('<body>')
-    body_end = content.find('</body>')
-    
-    if body_start == -1 or body_end == -1:
+    body_content = sections.get('body')
+    if body_content is None:
         print("❌ Error: Could not find <body> section")
         return False
-    
-    body_content = content[body_start + len('<body>'):body_end].strip()
+    body_content = body_content.strip()
     print(f"✅ Extracted body content ({len(body_content)} characters)")
     
-    # Extract script section
-    script_start = content.find('<script>')
-    script_end = content.rfind('</script>') + len('</script>')  # Use rfind for last script
-    
-    if script_start == -1 or script_end == -1:
+    script_block = sections.get('script')
+    if script_block is None:
         print("❌ Error: Could not find <script> section")
         return False
-    
-    script_block = content[script_start:script_end]
     print(f"✅ Extracted script block ({len(script_block)} characters)")
     
     # Create new template with Jinja2 blocks
-    new_template = f'''{{% extends "base.html" %}}
-
-{{% block title %}}Dashboard - Executive Dashboard{{% endblock %}}
-
-{{% block extra_styles %}}
-{css_block}
-{{% endblock %}}
-
-{{% block content %}}
-{body_content}
-{{% endblock %}}
-
-{{% block extra_scripts %}}
-{script_block}
-{{% endblock %}}
-'''
+    new_template = "".join([
+        '{% extends "base.html" %}\n\n',
+        '{% block title %}Dashboard - Executive Dashboard{% endblock %}\n\n',
+        '{% block extra_styles %}\n', css_block, '\n{% endblock %}\n\n',
+        '{% block content %}\n', body_content, '\n{% endblock %}\n\n',
+        '{% block extra_scripts %}\n', script_block, '\n{% endblock %}\n',
+    ])
     
     # Write to output file
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(new_template)
+        Path(output_file).write_text(new_template, encoding='utf-8')
         print(f"✅ Successfully created {output_file}")
         print(f"📊 File size: {len(new_template)} characters")
         return True
@@ -80,28 +74,37 @@ def convert_report_to_dashboard(input_file='report.html', output_file='dashboard
         return False
 
 
+# (check name, marker, whether the marker should be present)
+VERIFY_CHECKS = [
+    ('Extends base', '{% extends "base.html" %}', True),
+    ('Title block', '{% block title %}', True),
+    ('Styles block', '{% block extra_styles %}', True),
+    ('Content block', '{% block content %}', True),
+    ('Scripts block', '{% block extra_scripts %}', True),
+    ('No DOCTYPE', '<!DOCTYPE', False),
+    ('No html tag', '<html', False),
+    ('No head tag', '<head>', False),
+    ('No body tag', '<body>', False),
+]
+VERIFY_MARKERS_RE = re.compile('|'.join(re.escape(marker) for _, marker, _ in VERIFY_CHECKS))
+
+
 def verify_conversion(output_file='dashboard.html'):
     """Verify the converted file has correct structure"""
     
     print(f"\n🔍 Verifying {output_file}...")
     
     try:
-        with open(output_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = Path(output_file).read_text(encoding='utf-8')
     except FileNotFoundError:
         print(f"❌ {output_file} not found")
         return False
     
+    # One scan collects every marker present in the file
+    found = {match.group() for match in VERIFY_MARKERS_RE.finditer(content)}
     checks = {
-        'Extends base': '{{% extends "base.html" %}}' in content,
-        'Title block': '{{% block title %}}' in content,
-        'Styles block': '{{% block extra_styles %}}' in content,
-        'Content block': '{{% block content %}}' in content,
-        'Scripts block': '{{% block extra_scripts %}}' in content,
-        'No DOCTYPE': '<!DOCTYPE' not in content,
-        'No html tag': '<html' not in content,
-        'No head tag': '<head>' not in content,
-        'No body tag': '<body>' not in content,
+        check: (marker in found) == expected
+        for check, marker, expected in VERIFY_CHECKS
     }
     
     all_passed = True